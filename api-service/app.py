@@ -5,16 +5,22 @@ Lightweight alternative to SQLAlchemy
 
 from datetime import datetime, date
 from typing import List, Optional, Dict, Any
+import asyncio
+import hashlib
+import hmac
 import os
-import subprocess
+import secrets
+import struct
 import time
-from contextlib import asynccontextmanager
-import mysql.connector
-from mysql.connector import pooling
+from contextlib import asynccontextmanager, suppress
+import aiomysql
+from cachetools import TTLCache
+from pymysql.constants import CR, ER
 
-from fastapi import FastAPI, HTTPException, Depends, status, Query, Path, Path
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi import FastAPI, HTTPException, status, Query, Path, Path
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.openapi.utils import get_openapi
+from fastapi.responses import ORJSONResponse, Response
 from pydantic import BaseModel, Field, ConfigDict
 import logging
 
@@ -23,18 +29,182 @@ DB_CONFIG = {
     'host': os.getenv('DB_HOST', 'radius-db'),
     'user': os.getenv('DB_USER', 'radius'),
     'password': os.getenv('DB_PASS', 'radiuspass'),
-    'database': os.getenv('DB_NAME', 'radius'),
+    'db': os.getenv('DB_NAME', 'radius'),
     'port': int(os.getenv('DB_PORT', '3306')),
     'autocommit': False,
     'charset': 'utf8mb4'
 }
 
-# Global connection pool - will be initialized lazily
-connection_pool = None
+# Connection pool sizing, per worker process: keeps DB_POOL_MIN warm, grows to
+# DB_POOL_SIZE + DB_POOL_OVERFLOW. By default a budget of 25 + 10 connections is
+# split across the WEB_CONCURRENCY workers (set by gunicorn_conf.py), so the
+# total stays well under MySQL's default max_connections of 151. Empty values
+# (as docker-compose passes for unset overrides) fall back to the defaults.
+WEB_CONCURRENCY = max(1, int(os.getenv('WEB_CONCURRENCY') or '1'))
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE') or max(2, 25 // WEB_CONCURRENCY))
+DB_POOL_OVERFLOW = int(os.getenv('DB_POOL_OVERFLOW') or max(1, 10 // WEB_CONCURRENCY))
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN') or min(5, DB_POOL_SIZE))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '3600'))
+# Client errors meaning the server closed a pooled connection
+CONNECTION_LOST_ERRORS = (CR.CR_SERVER_GONE_ERROR, CR.CR_SERVER_LOST)
 
 # Security Configuration
 BEARER_TOKEN = os.getenv('API_KEY', 'your-secret-bearer-token-here')
-security = HTTPBearer()
+BEARER_TOKEN_BYTES = BEARER_TOKEN.encode()
+
+# Paths served without a bearer token
+PUBLIC_PATHS = {"/", "/health", "/docs", "/docs/oauth2-redirect", "/redoc", "/openapi.json"}
+
+# RADIUS Dynamic Authorization (RFC 5176) Configuration
+RADIUS_COA_PORT = int(os.getenv('RADIUS_COA_PORT', '3799'))
+RADIUS_COA_SECRET = os.getenv('RADIUS_COA_SECRET', '')
+RADIUS_COA_TIMEOUT = float(os.getenv('RADIUS_COA_TIMEOUT', '2.0'))
+
+# /health snapshot refresh period in seconds
+HEALTH_REFRESH_INTERVAL = float(os.getenv('HEALTH_REFRESH_INTERVAL', '5'))
+# A probe slower than this counts as a database failure
+HEALTH_PROBE_TIMEOUT = HEALTH_REFRESH_INTERVAL / 2
+# A snapshot older than this many intervals means the refresher is stuck or dead
+HEALTH_STALE_INTERVALS = 3
+
+# Largest page any paginated endpoint will return
+MAX_PAGE_SIZE = 500
+
+# Online session cache - dashboards poll these reads every few seconds
+ONLINE_CACHE_TTL = int(os.getenv('ONLINE_CACHE_TTL', '3'))
+online_cache = TTLCache(maxsize=8, ttl=ONLINE_CACHE_TTL)
+online_cache_lock = asyncio.Lock()
+
+# SQL Statements
+Q_HEALTH = "SELECT 1"
+
+Q_USER_EXISTS = "SELECT 1 FROM radcheck WHERE username = %s LIMIT 1"
+Q_PACKAGE_EXISTS = "SELECT 1 FROM radgroupcheck WHERE groupname = %s LIMIT 1"
+Q_NAS_EXISTS = "SELECT 1 FROM nas WHERE nasname = %s LIMIT 1"
+Q_USER_GROUP_EXISTS = "SELECT 1 FROM radusergroup WHERE username = %s LIMIT 1"
+
+Q_PACKAGE_INSERT_GUARDED = """
+    INSERT INTO radgroupcheck (groupname, attribute, op, value)
+    SELECT %s, %s, %s, %s FROM DUAL
+    WHERE NOT EXISTS (SELECT 1 FROM radgroupcheck WHERE groupname = %s)
+"""
+Q_GROUP_REPLY_INSERT = "INSERT INTO radgroupreply (groupname, attribute, op, value) VALUES (%s, %s, %s, %s)"
+Q_PACKAGE_PAGE = """
+    SELECT groupname, COUNT(*) OVER() AS total_count
+    FROM radgroupcheck 
+    GROUP BY groupname 
+    LIMIT %s OFFSET %s
+"""
+Q_PACKAGE_USER_COUNT = "SELECT COUNT(*) FROM radusergroup WHERE groupname = %s"
+Q_PACKAGE_DELETE_CHECK = "DELETE FROM radgroupcheck WHERE groupname = %s"
+Q_PACKAGE_DELETE_REPLY = "DELETE FROM radgroupreply WHERE groupname = %s"
+Q_PACKAGE_UPDATE_POOL = """
+    UPDATE radgroupreply 
+    SET value = %s 
+    WHERE groupname = %s AND attribute = 'Framed-Pool'
+"""
+
+Q_USER_INSERT_GUARDED = """
+    INSERT INTO radcheck (username, attribute, op, value)
+    SELECT * FROM (
+        SELECT %s AS username, %s AS attribute, %s AS op, %s AS value
+        UNION ALL
+        SELECT %s, %s, %s, %s
+    ) AS new_rows
+    WHERE NOT EXISTS (SELECT 1 FROM radcheck WHERE username = %s)
+"""
+Q_USER_GROUP_INSERT = "INSERT INTO radusergroup (username, groupname, priority) VALUES (%s, %s, %s)"
+Q_USER_GROUP_UPDATE = "UPDATE radusergroup SET groupname = %s WHERE username = %s"
+Q_USER_DELETE = """
+    DELETE rc, rug
+    FROM radcheck rc
+    LEFT JOIN radusergroup rug ON rug.username = rc.username
+    WHERE rc.username = %s
+"""
+# One branch per username, joined with UNION ALL; logdata is NULL when absent
+Q_RADCHECK_BY_USERNAME_BRANCH = """
+    SELECT %s AS requested, JSON_ARRAYAGG(JSON_OBJECT('username', username, 'value', value)) AS logdata
+    FROM radcheck
+    WHERE username = %s
+"""
+
+ACCT_COLUMNS = """radacctid, username, acctterminatecause, callingstationid, 
+    nasipaddress, acctstarttime, acctupdatetime, acctstoptime,
+    acctsessiontime, acctinputoctets, acctoutputoctets, framedipaddress"""
+Q_ACCT_PAGE = f"""
+    SELECT {ACCT_COLUMNS},
+           COUNT(*) OVER() AS total_count
+    FROM radacct 
+    WHERE username = %s 
+      AND DATE(acctstarttime) >= %s 
+      AND DATE(acctstarttime) <= %s
+    ORDER BY radacctid DESC
+    LIMIT %s OFFSET %s
+"""
+Q_ACCT_PAGE_AFTER = f"""
+    SELECT {ACCT_COLUMNS}
+    FROM radacct 
+    WHERE username = %s 
+      AND radacctid < %s
+      AND DATE(acctstarttime) >= %s 
+      AND DATE(acctstarttime) <= %s
+    ORDER BY radacctid DESC
+    LIMIT %s
+"""
+Q_AUTHLOG_PAGE = """
+    SELECT id, username, passwd, reply, authdate,
+           COUNT(*) OVER() AS total_count
+    FROM radpostauth 
+    WHERE username = %s 
+      AND DATE(authdate) >= %s 
+      AND DATE(authdate) <= %s
+    ORDER BY authdate DESC
+    LIMIT %s OFFSET %s
+"""
+
+Q_ONLINE_USERS = """
+    SELECT radacctid, username, callingstationid, nasipaddress, 
+           acctstarttime, framedipaddress
+    FROM radacct 
+    WHERE acctstoptime IS NULL
+"""
+Q_ONLINE_COUNT = "SELECT COUNT(*) FROM radacct WHERE acctstoptime IS NULL"
+Q_USER_ONLINE = "SELECT 1 FROM radacct WHERE username = %s AND acctstoptime IS NULL LIMIT 1"
+Q_USER_ACTIVE_SESSIONS = """
+    SELECT acctsessionid, nasipaddress 
+    FROM radacct 
+    WHERE username = %s AND acctstoptime IS NULL
+"""
+
+Q_NAS_INSERT_GUARDED = """
+    INSERT INTO nas (nasname, shortname, type, secret, description) 
+    SELECT %s, %s, %s, %s, %s FROM DUAL
+    WHERE NOT EXISTS (SELECT 1 FROM nas WHERE nasname = %s)
+"""
+Q_NAS_ACTIVE_SESSION_COUNT = "SELECT COUNT(*) FROM radacct WHERE nasipaddress = %s AND acctstoptime IS NULL"
+Q_NAS_DELETE = "DELETE FROM nas WHERE nasname = %s"
+Q_NAS_SECRET = "SELECT secret FROM nas WHERE nasname = %s LIMIT 1"
+
+Q_RADACCT_CLEANUP_PREVIEW = """
+    SELECT COUNT(*) as records_to_delete,
+           MIN(acctstarttime) as oldest_record
+    FROM radacct 
+    WHERE acctstarttime < DATE_SUB(NOW(), INTERVAL %s DAY)
+"""
+Q_RADACCT_CLEANUP = """
+    DELETE FROM radacct 
+    WHERE acctstarttime < DATE_SUB(NOW(), INTERVAL %s DAY)
+"""
+Q_RADPOSTAUTH_CLEANUP_PREVIEW = """
+    SELECT COUNT(*) as records_to_delete,
+           MIN(authdate) as oldest_record
+    FROM radpostauth 
+    WHERE authdate < DATE_SUB(NOW(), INTERVAL %s DAY)
+"""
+Q_RADPOSTAUTH_CLEANUP = """
+    DELETE FROM radpostauth 
+    WHERE authdate < DATE_SUB(NOW(), INTERVAL %s DAY)
+"""
 
 # Logging Configuration
 logging.basicConfig(level=logging.INFO)
@@ -58,6 +228,12 @@ class PaginatedResponse(BaseModel):
     count: int
     data: List[Any]
 
+class CursorPaginatedResponse(PaginatedResponse):
+    """count is the total number of matches in offset mode; it is omitted in
+    cursor (after_radacctid) mode, where no total is computed"""
+    count: Optional[int] = None
+    next_cursor: Optional[int] = None
+
 class DisconnectUserRequest(BaseModel):
     username: str = Field(..., min_length=1, max_length=64)
 
@@ -83,88 +259,231 @@ class DatabaseManager:
     def __init__(self):
         self.pool = None
     
-    def _ensure_pool(self):
+    async def _ensure_pool(self):
         if self.pool is None:
             max_retries = 30
             retry_delay = 2
             
             for attempt in range(max_retries):
                 try:
-                    self.pool = pooling.MySQLConnectionPool(
-                        pool_name="radius_pool",
-                        pool_size=10,
-                        pool_reset_session=True,
+                    self.pool = await aiomysql.create_pool(
+                        minsize=DB_POOL_MIN,
+                        maxsize=DB_POOL_SIZE + DB_POOL_OVERFLOW,
+                        pool_recycle=DB_POOL_RECYCLE,
                         **DB_CONFIG
                     )
                     logger.info("Database connection pool created successfully")
                     return
-                except mysql.connector.Error as e:
+                except (aiomysql.Error, OSError) as e:
                     if attempt == max_retries - 1:
                         logger.error(f"Failed to create database pool after {max_retries} attempts: {e}")
                         raise HTTPException(status_code=503, detail="Database connection failed")
                     logger.warning(f"Database connection attempt {attempt + 1} failed, retrying in {retry_delay}s: {e}")
-                    time.sleep(retry_delay)
+                    await asyncio.sleep(retry_delay)
     
-    def get_connection(self):
-        self._ensure_pool()
-        return self.pool.get_connection()
+    async def connect(self):
+        await self._ensure_pool()
+        return self.pool
     
-    def execute_query(self, query: str, params: Optional[tuple] = None, fetch: bool = True):
-        """Execute a query and return results"""
-        conn = None
-        cursor = None
+    def pool_stats(self) -> Dict[str, int]:
+        """Report pool occupancy so monitoring can spot exhaustion"""
+        if self.pool is None:
+            return {"size": 0, "free": 0, "max": DB_POOL_SIZE + DB_POOL_OVERFLOW}
+        return {"size": self.pool.size, "free": self.pool.freesize, "max": self.pool.maxsize}
+    
+    async def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            await self.pool.wait_closed()
+            self.pool = None
+    
+    async def _rollback(self, conn):
+        """Roll back, tolerating a connection the driver has already closed"""
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor(dictionary=True)
-            cursor.execute(query, params if params is not None else ())
-            
-            if fetch:
-                if query.strip().upper().startswith('SELECT'):
-                    return cursor.fetchall()
-                else:
-                    conn.commit()
-                    return cursor.rowcount
-            else:
-                conn.commit()
-                return cursor.lastrowid
-                
-        except mysql.connector.Error as e:
-            if conn:
-                conn.rollback()
-            raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-        finally:
-            if cursor:
-                cursor.close()
-            if conn:
-                conn.close()
-    
-    def execute_transaction(self, queries: List[tuple]):
-        """Execute multiple queries in a transaction"""
-        conn = None
-        cursor = None
+            await conn.rollback()
+        except aiomysql.Error:
+            pass  # Broken connection; the pool discards it on release
+    
+    async def _end_read(self, conn):
+        """End the implicit read transaction so the pool keeps the connection.
+        
+        With autocommit off a SELECT leaves the connection in a transaction,
+        and aiomysql closes such connections on release instead of reusing them.
+        """
+        await self._rollback(conn)
+    
+    async def execute_query(self, query: str, params: Optional[tuple] = None, fetch: bool = True,
+                            fetch_mode: str = 'dict'):
+        """Execute a query and return results.
+        
+        fetch_mode shapes SELECT results: 'dict' (list of dicts) or 'scalar'
+        (first column of the first row, None if empty).
+        
+        A SELECT that fails because the server dropped the pooled connection
+        (restart, wait_timeout) is retried once on a fresh connection.
+        """
+        if fetch_mode not in ('dict', 'scalar'):
+            raise ValueError(f"Unknown fetch_mode: {fetch_mode!r}")
+        is_select = fetch and query.strip().upper().startswith('SELECT')
+        await self._ensure_pool()
+        
+        for attempt in range(2):
+            try:
+                return await self._execute_once(query, params, fetch, fetch_mode, is_select)
+            except aiomysql.OperationalError as e:
+                if attempt == 0 and is_select and e.args and e.args[0] in CONNECTION_LOST_ERRORS:
+                    logger.warning(f"Stale database connection, retrying query: {e}")
+                    continue
+                raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+            except (aiomysql.Error, OSError) as e:
+                raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    
+    async def _execute_once(self, query: str, params: Optional[tuple], fetch: bool,
+                            fetch_mode: str, is_select: bool):
+        cursor_class = aiomysql.DictCursor if fetch_mode == 'dict' else aiomysql.Cursor
+        async with self.pool.acquire() as conn:
+            try:
+                async with conn.cursor(cursor_class) as cursor:
+                    await cursor.execute(query, params if params is not None else ())
+                    
+                    if is_select:
+                        if fetch_mode == 'scalar':
+                            row = await cursor.fetchone()
+                            result = row[0] if row else None
+                        else:
+                            result = await cursor.fetchall()
+                        await self._end_read(conn)
+                        return result
+                    
+                    await conn.commit()
+                    return cursor.rowcount if fetch else cursor.lastrowid
+                    
+            except aiomysql.Error:
+                await self._rollback(conn)
+                raise
+    
+    async def execute_query_stream(self, query: str, params: Optional[tuple] = None):
+        """Yield SELECT rows one at a time from an unbuffered server-side cursor"""
+        await self._ensure_pool()
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            for query, params in queries:
-                cursor.execute(query, params if params is not None else ())
-            
-            conn.commit()
-            return True
-            
-        except mysql.connector.Error as e:
-            if conn:
-                conn.rollback()
-            raise HTTPException(status_code=500, detail=f"Transaction failed: {str(e)}")
-        finally:
-            if cursor:
-                cursor.close()
-            if conn:
-                conn.close()
+            async with self.pool.acquire() as conn:
+                try:
+                    async with conn.cursor(aiomysql.SSDictCursor) as cursor:
+                        await cursor.execute(query, params if params is not None else ())
+                        async for row in cursor:
+                            yield row
+                finally:
+                    await self._end_read(conn)
+        except (aiomysql.Error, OSError) as e:
+            raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    
+    async def execute_transaction(self, queries: List[tuple], conflict_detail: Optional[str] = None):
+        """Execute multiple queries in a transaction.
+        
+        A query whose params is a list of tuples is run with executemany, which
+        the driver folds into a single multi-row INSERT.
+        
+        If conflict_detail is given, the first query is treated as a guarded
+        insert: when it affects no rows the transaction is rolled back and a
+        400 is raised with that detail. Concurrent guarded inserts of the same
+        new key can deadlock on their gap locks; the loser is retried once,
+        when its NOT EXISTS check sees the winner's row.
+        """
+        await self._ensure_pool()
+        
+        for attempt in range(2):
+            try:
+                return await self._transaction_once(queries, conflict_detail)
+            except aiomysql.OperationalError as e:
+                if attempt == 0 and conflict_detail and e.args and e.args[0] == ER.LOCK_DEADLOCK:
+                    logger.warning(f"Deadlock on guarded insert, retrying transaction: {e}")
+                    continue
+                raise HTTPException(status_code=500, detail=f"Transaction failed: {str(e)}")
+            except (aiomysql.Error, OSError) as e:
+                raise HTTPException(status_code=500, detail=f"Transaction failed: {str(e)}")
+    
+    async def _transaction_once(self, queries: List[tuple], conflict_detail: Optional[str]):
+        async with self.pool.acquire() as conn:
+            try:
+                async with conn.cursor() as cursor:
+                    for index, (query, params) in enumerate(queries):
+                        if isinstance(params, list):
+                            await cursor.executemany(query, params)
+                        else:
+                            await cursor.execute(query, params if params is not None else ())
+                        if index == 0 and conflict_detail and cursor.rowcount == 0:
+                            await conn.rollback()
+                            raise HTTPException(status_code=400, detail=conflict_detail)
+                
+                await conn.commit()
+                return True
+                
+            except aiomysql.Error:
+                await self._rollback(conn)
+                raise
 
 # Initialize database manager
 db_manager = DatabaseManager()
 
+# Request Coalescing
+class RadcheckBatcher:
+    """Coalesce concurrent radcheck lookups into a single query"""
+    
+    def __init__(self, max_wait: float = 0.005, max_batch: int = 50):
+        self.max_wait = max_wait
+        self.max_batch = max_batch
+        self.pending: Dict[str, List[asyncio.Future]] = {}
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.tasks = set()
+    
+    async def lookup(self, username: str) -> Optional[str]:
+        """Return a user's radcheck rows as a JSON array string, or None if absent"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.setdefault(username, []).append(future)
+        
+        if len(self.pending) >= self.max_batch:
+            self._flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.max_wait, self._flush)
+        
+        return await future
+    
+    def _flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        
+        batch, self.pending = self.pending, {}
+        if batch:
+            task = asyncio.create_task(self._run(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+    
+    async def _run(self, batch: Dict[str, List[asyncio.Future]]):
+        # Each branch compares the column to a plain literal, so it matches (and
+        # uses the index) exactly like the single-user WHERE username = %s
+        query = ' UNION ALL '.join([Q_RADCHECK_BY_USERNAME_BRANCH] * len(batch))
+        params = tuple(value for username in batch for value in (username, username))
+        try:
+            rows = await db_manager.execute_query(query, params)
+        except Exception as e:
+            for futures in batch.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+        
+        logdata_by_user = {row['requested']: row['logdata'] for row in rows if row['logdata'] is not None}
+        
+        for username, futures in batch.items():
+            logdata = logdata_by_user.get(username)
+            for future in futures:
+                if not future.done():
+                    future.set_result(logdata)
+
+radcheck_batcher = RadcheckBatcher()
+
 # Date Validation Utility
 def validate_date_range(start_date: str, end_date: str):
     """Enhanced date range validation with additional checks."""
@@ -198,30 +517,158 @@ def validate_date_range(start_date: str, end_date: str):
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD (example: 2025-09-01)")
 
-# Dependency Functions
-async def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    if credentials.credentials != BEARER_TOKEN:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid authentication token",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    return credentials.credentials
+# RADIUS Disconnect Client
+RADIUS_DISCONNECT_REQUEST = 40
+RADIUS_DISCONNECT_ACK = 41
+RADIUS_ATTR_ACCT_SESSION_ID = 44
+
+class RadiusDisconnectProtocol(asyncio.DatagramProtocol):
+    def __init__(self, packet: bytes, identifier: int):
+        self.packet = packet
+        self.identifier = identifier
+        self.response = asyncio.get_running_loop().create_future()
+    
+    def connection_made(self, transport):
+        transport.sendto(self.packet)
+    
+    def datagram_received(self, data, addr):
+        if len(data) >= 20 and data[1] == self.identifier and not self.response.done():
+            self.response.set_result(data)
+    
+    def error_received(self, exc):
+        if not self.response.done():
+            self.response.set_exception(exc)
+
+async def send_disconnect_request(nas_ip: str, session_id: str, secret: str) -> bool:
+    """Send a Disconnect-Request for a session and return True on Disconnect-ACK."""
+    session_value = session_id.encode()
+    if not 0 < len(session_value) <= 253:
+        raise ValueError("Acct-Session-Id must be 1-253 bytes")
+    
+    identifier = secrets.randbelow(256)
+    attributes = bytes([RADIUS_ATTR_ACCT_SESSION_ID, len(session_value) + 2]) + session_value
+    header = struct.pack('!BBH', RADIUS_DISCONNECT_REQUEST, identifier, 20 + len(attributes))
+    secret_bytes = secret.encode()
+    authenticator = hashlib.md5(header + bytes(16) + attributes + secret_bytes).digest()
+    
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: RadiusDisconnectProtocol(header + authenticator + attributes, identifier),
+        remote_addr=(nas_ip, RADIUS_COA_PORT)
+    )
+    try:
+        response = await asyncio.wait_for(protocol.response, timeout=RADIUS_COA_TIMEOUT)
+    finally:
+        transport.close()
+    
+    response = response[:struct.unpack('!H', response[2:4])[0]]
+    expected = hashlib.md5(response[:4] + authenticator + response[20:] + secret_bytes).digest()
+    if response[4:20] != expected:
+        raise ValueError("Invalid response authenticator from NAS")
+    
+    return response[0] == RADIUS_DISCONNECT_ACK
+
+# Pagination Utility
+def pop_total_count(records: List[Dict[str, Any]]) -> int:
+    """Strip the COUNT(*) OVER() total_count column from a page and return it."""
+    count = records[0]['total_count'] if records else 0
+    for record in records:
+        del record['total_count']
+    return count
+
+# Authentication Middleware
+class TokenMiddleware:
+    """Check the bearer token straight from the ASGI scope, before routing"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in PUBLIC_PATHS:
+            await self.app(scope, receive, send)
+            return
+        
+        # Same responses as the HTTPBearer dependency this replaces
+        auth = next((value for name, value in scope["headers"] if name == b"authorization"), b"")
+        scheme, _, credentials = auth.partition(b" ")
+        if not (scheme and credentials):
+            response = ORJSONResponse({"detail": "Not authenticated"}, status_code=status.HTTP_403_FORBIDDEN)
+            await response(scope, receive, send)
+            return
+        
+        if scheme.lower() != b"bearer":
+            response = ORJSONResponse(
+                {"detail": "Invalid authentication credentials"},
+                status_code=status.HTTP_403_FORBIDDEN,
+            )
+            await response(scope, receive, send)
+            return
+        
+        if not hmac.compare_digest(credentials, BEARER_TOKEN_BYTES):
+            response = ORJSONResponse(
+                {"detail": "Invalid authentication token"},
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+            await response(scope, receive, send)
+            return
+        
+        await self.app(scope, receive, send)
+
+# Health Monitoring
+async def probe_health() -> Dict[str, Any]:
+    """Test the database connection and build the /health payload"""
+    try:
+        await asyncio.wait_for(db_manager.execute_query(Q_HEALTH), timeout=HEALTH_PROBE_TIMEOUT)
+        db_status = "connected"
+    except asyncio.TimeoutError:
+        db_status = f"error: no response within {HEALTH_PROBE_TIMEOUT:g}s"
+    except Exception as e:
+        db_status = f"error: {str(e)}"
+    
+    return {
+        "status": "healthy" if db_status == "connected" else "unhealthy",
+        "database": db_status,
+        "pool": db_manager.pool_stats(),
+        "timestamp": datetime.now().isoformat()
+    }
+
+async def record_health(app: FastAPI):
+    """Store a fresh probe result and when it was taken"""
+    app.state.health = await probe_health()
+    app.state.health_checked_at = time.monotonic()
+
+async def refresh_health(app: FastAPI):
+    """Keep app.state.health current, independent of /health traffic"""
+    while True:
+        await asyncio.sleep(HEALTH_REFRESH_INTERVAL)
+        await record_health(app)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("Starting RADIUS Management API")
+    app.state.pool = await db_manager.connect()
+    await record_health(app)
+    health_task = asyncio.create_task(refresh_health(app))
     yield
     logger.info("Shutting down RADIUS Management API")
+    health_task.cancel()
+    with suppress(asyncio.CancelledError):
+        await health_task
+    await db_manager.close()
 
 # FastAPI App
 app = FastAPI(
     title="RADIUS Management API (Raw MySQL)",
     description="FastAPI-based RADIUS management with raw MySQL queries",
     version="2.0.0",
+    default_response_class=ORJSONResponse,
     lifespan=lifespan
 )
 
+# Added first so CORS wraps it: preflights pass and 401s carry CORS headers
+app.add_middleware(TokenMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -238,331 +685,261 @@ async def root():
 # Package Management
 @app.post("/package", response_model=StatusResponse, status_code=status.HTTP_201_CREATED)
 async def create_package(
-    package: PackageCreate,
-    token: str = Depends(verify_token)
+    package: PackageCreate
 ):
     """Create a new package with default attributes."""
     
-    # Check if package exists
-    check_query = "SELECT COUNT(*) as count FROM radgroupcheck WHERE groupname = %s"
-    result = db_manager.execute_query(check_query, (package.package,))
-    
-    if result[0]['count'] > 0:
-        raise HTTPException(status_code=400, detail="Package already exists")
-    
-    # Insert package attributes
+    # Insert package attributes; the first insert is skipped if the package exists
     queries = [
-        ("INSERT INTO radgroupcheck (groupname, attribute, op, value) VALUES (%s, %s, %s, %s)",
-         (package.package, 'Simultaneous-Use', ':=', '1')),
-        ("INSERT INTO radgroupreply (groupname, attribute, op, value) VALUES (%s, %s, %s, %s)",
-         (package.package, 'Framed-Pool', '=', package.pool)),
-        ("INSERT INTO radgroupreply (groupname, attribute, op, value) VALUES (%s, %s, %s, %s)",
-         (package.package, 'Acct-Interim-Interval', '=', '120'))
+        (Q_PACKAGE_INSERT_GUARDED,
+         (package.package, 'Simultaneous-Use', ':=', '1', package.package)),
+        (Q_GROUP_REPLY_INSERT,
+         [(package.package, 'Framed-Pool', '=', package.pool),
+          (package.package, 'Acct-Interim-Interval', '=', '120')])
     ]
     
-    db_manager.execute_transaction(queries)
+    await db_manager.execute_transaction(queries, conflict_detail="Package already exists")
     return StatusResponse(message="Package created successfully")
 
 @app.get("/package/{limit}/{offset}", response_model=PaginatedResponse)
 async def get_packages(
-    limit: int,
-    offset: int,
-    token: str = Depends(verify_token)
+    limit: int = Path(..., ge=1, le=MAX_PAGE_SIZE),
+    offset: int = Path(..., ge=0)
 ):
     """Get paginated list of packages."""
     
-    # Get count
-    count_query = "SELECT COUNT(DISTINCT groupname) as count FROM radgroupcheck"
-    count_result = db_manager.execute_query(count_query)
-    count = count_result[0]['count']
-    
-    # Get packages
-    packages_query = """
-        SELECT DISTINCT groupname 
-        FROM radgroupcheck 
-        GROUP BY groupname 
-        LIMIT %s OFFSET %s
-    """
-    packages = db_manager.execute_query(packages_query, (limit, offset))
+    # Get packages along with the total package count
+    packages = await db_manager.execute_query(Q_PACKAGE_PAGE, (limit, offset))
+    count = pop_total_count(packages)
     
     return PaginatedResponse(count=count, data=packages)
 
 @app.delete("/package/{package_name}", response_model=StatusResponse)
 async def delete_package(
-    package_name: str,
-    token: str = Depends(verify_token)
+    package_name: str
 ):
     """Delete a package and all its associated configurations."""
     
     # Check if package exists
-    check_query = "SELECT COUNT(*) as count FROM radgroupcheck WHERE groupname = %s"
-    result = db_manager.execute_query(check_query, (package_name,))
+    result = await db_manager.execute_query(Q_PACKAGE_EXISTS, (package_name,), fetch_mode='scalar')
     
-    if result[0]['count'] == 0:
+    if not result:
         raise HTTPException(status_code=404, detail="Package not found")
     
     # Check if any users are using this package
-    users_query = "SELECT COUNT(*) as count FROM radusergroup WHERE groupname = %s"
-    users_result = db_manager.execute_query(users_query, (package_name,))
+    users_count = await db_manager.execute_query(Q_PACKAGE_USER_COUNT, (package_name,), fetch_mode='scalar')
     
-    if users_result[0]['count'] > 0:
+    if users_count > 0:
         raise HTTPException(
             status_code=409, 
-            detail=f"Cannot delete package. {users_result[0]['count']} user(s) are using this package"
+            detail=f"Cannot delete package. {users_count} user(s) are using this package"
         )
     
     # Delete package configurations
     queries = [
-        ("DELETE FROM radgroupcheck WHERE groupname = %s", (package_name,)),
-        ("DELETE FROM radgroupreply WHERE groupname = %s", (package_name,))
+        (Q_PACKAGE_DELETE_CHECK, (package_name,)),
+        (Q_PACKAGE_DELETE_REPLY, (package_name,))
     ]
     
-    db_manager.execute_transaction(queries)
+    await db_manager.execute_transaction(queries)
     return StatusResponse(message=f"Package '{package_name}' deleted successfully")
 
 @app.put("/package/{package_name}", response_model=StatusResponse)
 async def update_package(
     package_name: str,
-    package_update: PackageUpdate,
-    token: str = Depends(verify_token)
+    package_update: PackageUpdate
 ):
     """Update package configuration."""
     
     # Check if package exists
-    check_query = "SELECT COUNT(*) as count FROM radgroupcheck WHERE groupname = %s"
-    result = db_manager.execute_query(check_query, (package_name,))
+    result = await db_manager.execute_query(Q_PACKAGE_EXISTS, (package_name,), fetch_mode='scalar')
     
-    if result[0]['count'] == 0:
+    if not result:
         raise HTTPException(status_code=404, detail="Package not found")
     
     if package_update.pool is None:
         raise HTTPException(status_code=400, detail="No fields provided for update")
     
     # Update the pool in radgroupreply table
-    update_query = """
-        UPDATE radgroupreply 
-        SET value = %s 
-        WHERE groupname = %s AND attribute = 'Framed-Pool'
-    """
-    affected_rows = db_manager.execute_query(update_query, (package_update.pool, package_name), fetch=False)
+    affected_rows = await db_manager.execute_query(Q_PACKAGE_UPDATE_POOL, (package_update.pool, package_name), fetch=False)
     
     if affected_rows == 0:
         # If no Framed-Pool attribute exists, create it
-        insert_query = """
-            INSERT INTO radgroupreply (groupname, attribute, op, value) 
-            VALUES (%s, %s, %s, %s)
-        """
-        db_manager.execute_query(insert_query, (package_name, 'Framed-Pool', '=', package_update.pool), fetch=False)
+        await db_manager.execute_query(Q_GROUP_REPLY_INSERT, (package_name, 'Framed-Pool', '=', package_update.pool), fetch=False)
     
     return StatusResponse(message=f"Package '{package_name}' updated successfully")
 
 # User Management
 @app.post("/user", response_model=StatusResponse, status_code=status.HTTP_201_CREATED)
 async def create_user(
-    user: UserCreate,
-    token: str = Depends(verify_token)
+    user: UserCreate
 ):
     """Create a new user."""
     
-    # Check if user exists
-    check_query = "SELECT COUNT(*) as count FROM radcheck WHERE username = %s"
-    result = db_manager.execute_query(check_query, (user.username,))
-    
-    if result[0]['count'] > 0:
-        raise HTTPException(status_code=400, detail="User already exists")
-    
-    # Create user
+    # Create user; the radcheck rows are skipped if the user exists
     queries = [
-        ("INSERT INTO radcheck (username, attribute, op, value) VALUES (%s, %s, %s, %s)",
-         (user.username, 'Cleartext-Password', ':=', user.passwd)),
-        ("INSERT INTO radcheck (username, attribute, op, value) VALUES (%s, %s, %s, %s)",
-         (user.username, 'Expiration', ':=', user.expdate)),
-        ("INSERT INTO radusergroup (username, groupname) VALUES (%s, %s)",
-         (user.username, user.package))
+        (Q_USER_INSERT_GUARDED,
+         (user.username, 'Cleartext-Password', ':=', user.passwd,
+          user.username, 'Expiration', ':=', user.expdate,
+          user.username)),
+        (Q_USER_GROUP_INSERT,
+         (user.username, user.package, 1))
     ]
     
-    db_manager.execute_transaction(queries)
+    await db_manager.execute_transaction(queries, conflict_detail="User already exists")
     return StatusResponse(message="User created successfully")
 
 @app.get("/user/{username}")
 async def get_user(
-    username: str,
-    token: str = Depends(verify_token)
+    username: str
 ):
     """Get specific user details."""
     
-    query = "SELECT username, value FROM radcheck WHERE username = %s"
-    users = db_manager.execute_query(query, (username,))
+    # logdata arrives as a JSON array built by MySQL; pass it through unparsed
+    logdata = await radcheck_batcher.lookup(username)
     
-    if not users:
+    if logdata is None:
         raise HTTPException(status_code=404, detail="User not found")
     
-    return {"logdata": users}
+    return Response(content=b'{"logdata":' + logdata.encode() + b'}', media_type="application/json")
 
 @app.delete("/user/{username}", response_model=StatusResponse)
 async def delete_user(
-    username: str,
-    token: str = Depends(verify_token)
+    username: str
 ):
     """Delete a user."""
     
     # Check if user exists
-    check_query = "SELECT COUNT(*) as count FROM radcheck WHERE username = %s"
-    result = db_manager.execute_query(check_query, (username,))
+    result = await db_manager.execute_query(Q_USER_EXISTS, (username,), fetch_mode='scalar')
     
-    if result[0]['count'] == 0:
+    if not result:
         raise HTTPException(status_code=404, detail="User not found")
     
-    # Delete user
-    queries = [
-        ("DELETE FROM radcheck WHERE username = %s", (username,)),
-        ("DELETE FROM radusergroup WHERE username = %s", (username,))
-    ]
-    
-    db_manager.execute_transaction(queries)
+    # Delete user check rows and package assignment in one statement
+    await db_manager.execute_query(Q_USER_DELETE, (username,), fetch=False)
     return StatusResponse(message="User deleted successfully")
 
 @app.post("/change-package", response_model=StatusResponse)
 async def change_user_package(
-    request: ChangePackageRequest,
-    token: str = Depends(verify_token)
+    request: ChangePackageRequest
 ):
     """Change user's package assignment by updating radusergroup table."""
     
     # Validate user exists
-    user_check_query = "SELECT COUNT(*) as count FROM radcheck WHERE username = %s"
-    user_result = db_manager.execute_query(user_check_query, (request.username,))
+    user_result = await db_manager.execute_query(Q_USER_EXISTS, (request.username,), fetch_mode='scalar')
     
-    if user_result[0]['count'] == 0:
+    if not user_result:
         raise HTTPException(status_code=404, detail="User not found")
     
     # Validate package exists
-    package_check_query = "SELECT COUNT(*) as count FROM radgroupcheck WHERE groupname = %s"
-    package_result = db_manager.execute_query(package_check_query, (request.package,))
+    package_result = await db_manager.execute_query(Q_PACKAGE_EXISTS, (request.package,), fetch_mode='scalar')
     
-    if package_result[0]['count'] == 0:
+    if not package_result:
         raise HTTPException(status_code=404, detail="Package not found")
     
     # Check if user already has a package assignment in radusergroup
-    existing_query = "SELECT COUNT(*) as count FROM radusergroup WHERE username = %s"
-    existing_result = db_manager.execute_query(existing_query, (request.username,))
+    existing_result = await db_manager.execute_query(Q_USER_GROUP_EXISTS, (request.username,), fetch_mode='scalar')
     
-    if existing_result[0]['count'] > 0:
+    if existing_result:
         # Update existing package assignment
-        update_query = "UPDATE radusergroup SET groupname = %s WHERE username = %s"
-        db_manager.execute_query(update_query, (request.package, request.username), fetch=False)
+        await db_manager.execute_query(Q_USER_GROUP_UPDATE, (request.package, request.username), fetch=False)
     else:
         # Insert new package assignment
-        insert_query = "INSERT INTO radusergroup (username, groupname, priority) VALUES (%s, %s, %s)"
-        db_manager.execute_query(insert_query, (request.username, request.package, 1), fetch=False)
+        await db_manager.execute_query(Q_USER_GROUP_INSERT, (request.username, request.package, 1), fetch=False)
     
     return StatusResponse(message=f"User '{request.username}' package changed to '{request.package}' successfully")
 
 # Accounting
-@app.get("/acct/{username}/{start_date}/{end_date}/{limit}/{offset}", response_model=PaginatedResponse)
+@app.get("/acct/{username}/{start_date}/{end_date}/{limit}/{offset}", responses={200: {"model": CursorPaginatedResponse}})
 async def get_user_accounting_by_date_range(
     username: str,
     start_date: str,
     end_date: str,
-    limit: int,
-    offset: int,
-    token: str = Depends(verify_token)
+    limit: int = Path(..., ge=1, le=MAX_PAGE_SIZE),
+    offset: int = Path(..., ge=0),
+    after_radacctid: Optional[int] = Query(None, ge=1, description="Keyset cursor (next_cursor of the previous page); replaces offset")
 ):
-    """Get user accounting records within a date range."""
+    """Get user accounting records within a date range, newest first.
+    
+    Deep pages should pass after_radacctid instead of a growing offset. In
+    cursor mode no total is computed, so the response has no count.
+    """
     
     # Validate date range
     validate_date_range(start_date, end_date)
     
     # Check if user exists
-    user_query = "SELECT COUNT(*) as count FROM radcheck WHERE username = %s"
-    user_result = db_manager.execute_query(user_query, (username,))
+    user_result = await db_manager.execute_query(Q_USER_EXISTS, (username,), fetch_mode='scalar')
     
-    if user_result[0]['count'] == 0:
+    if not user_result:
         raise HTTPException(status_code=404, detail="User not found")
     
-    # Get count with date range filter
-    count_query = """
-        SELECT COUNT(*) as count 
-        FROM radacct 
-        WHERE username = %s 
-          AND DATE(acctstarttime) >= %s 
-          AND DATE(acctstarttime) <= %s
-    """
-    count_result = db_manager.execute_query(count_query, (username, start_date, end_date))
-    count = count_result[0]['count']
-    
-    # Get records with date range filter
-    acct_query = """
-        SELECT radacctid, username, acctterminatecause, callingstationid, 
-               nasipaddress, acctstarttime, acctupdatetime, acctstoptime,
-               acctsessiontime, acctinputoctets, acctoutputoctets, framedipaddress
-        FROM radacct 
-        WHERE username = %s 
-          AND DATE(acctstarttime) >= %s 
-          AND DATE(acctstarttime) <= %s
-        ORDER BY acctstarttime DESC
-        LIMIT %s OFFSET %s
-    """
-    records = db_manager.execute_query(acct_query, (username, start_date, end_date, limit, offset))
+    if after_radacctid is not None:
+        # Keyset page: seek past the cursor on the (username, radacctid) index
+        stream = db_manager.execute_query_stream(Q_ACCT_PAGE_AFTER, (username, after_radacctid, start_date, end_date, limit))
+        records = [row async for row in stream]
+        next_cursor = records[-1]['radacctid'] if len(records) == limit else None
+        return ORJSONResponse({"data": records, "next_cursor": next_cursor})
+    
+    # Get records with date range filter along with the total match count
+    stream = db_manager.execute_query_stream(Q_ACCT_PAGE, (username, start_date, end_date, limit, offset))
+    records = [row async for row in stream]
+    count = pop_total_count(records)
     
-    return PaginatedResponse(count=count, data=records)
+    next_cursor = records[-1]['radacctid'] if len(records) == limit else None
+    return ORJSONResponse({"count": count, "data": records, "next_cursor": next_cursor})
 
 # Online Status
 @app.get("/online")
-async def get_online_users(token: str = Depends(verify_token)):
+async def get_online_users():
     """Get all online users."""
     
-    query = """
-        SELECT radacctid, username, callingstationid, nasipaddress, 
-               acctstarttime, framedipaddress
-        FROM radacct 
-        WHERE acctstoptime IS NULL
-    """
-    online_users = db_manager.execute_query(query)
-    return online_users
+    async with online_cache_lock:
+        if 'users' in online_cache:
+            return ORJSONResponse(online_cache['users'])
+        
+        online_users = await db_manager.execute_query(Q_ONLINE_USERS)
+        online_cache['users'] = online_users
+        return ORJSONResponse(online_users)
 
 @app.get("/onlinecount")
-async def get_online_count(token: str = Depends(verify_token)):
+async def get_online_count():
     """Get count of online users."""
     
-    query = "SELECT COUNT(*) as count FROM radacct WHERE acctstoptime IS NULL"
-    result = db_manager.execute_query(query)
-    return {"total_online": result[0]['count']}
+    async with online_cache_lock:
+        if 'count' in online_cache:
+            return {"total_online": online_cache['count']}
+        
+        total_online = await db_manager.execute_query(Q_ONLINE_COUNT, fetch_mode='scalar')
+        online_cache['count'] = total_online
+        return {"total_online": total_online}
 
 @app.get("/online/{username}")
 async def get_user_online_status(
-    username: str,
-    token: str = Depends(verify_token)
+    username: str
 ):
     """Check if specific user is online."""
     
     # Check if user exists
-    user_query = "SELECT COUNT(*) as count FROM radcheck WHERE username = %s"
-    user_result = db_manager.execute_query(user_query, (username,))
+    logdata = await radcheck_batcher.lookup(username)
     
-    if user_result[0]['count'] == 0:
+    if logdata is None:
         raise HTTPException(status_code=404, detail="User not found")
     
     # Check online status
-    online_query = """
-        SELECT COUNT(*) as count 
-        FROM radacct 
-        WHERE username = %s AND acctstoptime IS NULL
-    """
-    online_result = db_manager.execute_query(online_query, (username,))
+    online_result = await db_manager.execute_query(Q_USER_ONLINE, (username,), fetch_mode='scalar')
     
-    status_msg = "Online" if online_result[0]['count'] > 0 else "Offline"
+    status_msg = "Online" if online_result else "Offline"
     return {"status": status_msg}
 
 # Authentication Logs
-@app.get("/authlog/{username}/{start_date}/{end_date}/{limit}/{offset}", response_model=PaginatedResponse)
+@app.get("/authlog/{username}/{start_date}/{end_date}/{limit}/{offset}", responses={200: {"model": PaginatedResponse}})
 async def get_user_auth_logs_by_date_range(
     username: str,
     start_date: str,
     end_date: str,
-    limit: int,
-    offset: int,
-    token: str = Depends(verify_token)
+    limit: int = Path(..., ge=1, le=MAX_PAGE_SIZE),
+    offset: int = Path(..., ge=0)
 ):
     """Get authentication logs for a specific user from radpostauth table within a date range."""
     
@@ -570,36 +947,16 @@ async def get_user_auth_logs_by_date_range(
     validate_date_range(start_date, end_date)
     
     # Check if user exists
-    user_query = "SELECT COUNT(*) as count FROM radcheck WHERE username = %s"
-    user_result = db_manager.execute_query(user_query, (username,))
+    user_result = await db_manager.execute_query(Q_USER_EXISTS, (username,), fetch_mode='scalar')
     
-    if user_result[0]['count'] == 0:
+    if not user_result:
         raise HTTPException(status_code=404, detail="User not found")
     
-    # Get count of auth logs for the user with date range filter
-    count_query = """
-        SELECT COUNT(*) as count 
-        FROM radpostauth 
-        WHERE username = %s 
-          AND DATE(authdate) >= %s 
-          AND DATE(authdate) <= %s
-    """
-    count_result = db_manager.execute_query(count_query, (username, start_date, end_date))
-    count = count_result[0]['count']
-    
-    # Get auth logs with pagination and date range filter
-    auth_logs_query = """
-        SELECT id, username, passwd, reply, authdate
-        FROM radpostauth 
-        WHERE username = %s 
-          AND DATE(authdate) >= %s 
-          AND DATE(authdate) <= %s
-        ORDER BY authdate DESC
-        LIMIT %s OFFSET %s
-    """
-    logs = db_manager.execute_query(auth_logs_query, (username, start_date, end_date, limit, offset))
+    # Get auth logs with pagination and date range filter along with the total match count
+    logs = await db_manager.execute_query(Q_AUTHLOG_PAGE, (username, start_date, end_date, limit, offset))
+    count = pop_total_count(logs)
     
-    return PaginatedResponse(count=count, data=logs)
+    return ORJSONResponse({"count": count, "data": logs})
 
 # NAS Management
 @app.post("/nas", response_model=StatusResponse)
@@ -608,68 +965,53 @@ async def create_nas(
     shortname: str = Query(...),
     secret: str = Query(...),
     type: str = Query(default="other"),
-    description: str = Query(default="RADIUS Client"),
-    token: str = Depends(verify_token)
+    description: str = Query(default="RADIUS Client")
 ):
     """Create a new NAS."""
     
-    # Check if NAS exists
-    check_query = "SELECT COUNT(*) as count FROM nas WHERE nasname = %s"
-    result = db_manager.execute_query(check_query, (nasname,))
-    
-    if result[0]['count'] > 0:
-        raise HTTPException(status_code=400, detail="NAS already exists")
-    
-    # Create NAS
-    insert_query = """
-        INSERT INTO nas (nasname, shortname, type, secret, description) 
-        VALUES (%s, %s, %s, %s, %s)
-    """
-    db_manager.execute_query(insert_query, (nasname, shortname, type, secret, description), fetch=False)
+    # Create NAS unless one with the same nasname exists
+    await db_manager.execute_transaction(
+        [(Q_NAS_INSERT_GUARDED, (nasname, shortname, type, secret, description, nasname))],
+        conflict_detail="NAS already exists"
+    )
     
     return StatusResponse(message="NAS created successfully")
 
 @app.delete("/nas/{nasname}", response_model=StatusResponse)
 async def delete_nas(
-    nasname: str,
-    token: str = Depends(verify_token)
+    nasname: str
 ):
     """Delete a NAS entry."""
     
     # Check if NAS exists
-    check_query = "SELECT COUNT(*) as count FROM nas WHERE nasname = %s"
-    result = db_manager.execute_query(check_query, (nasname,))
+    result = await db_manager.execute_query(Q_NAS_EXISTS, (nasname,), fetch_mode='scalar')
     
-    if result[0]['count'] == 0:
+    if not result:
         raise HTTPException(status_code=404, detail="NAS not found")
     
     # Check if NAS is being used in active sessions
-    active_sessions_query = "SELECT COUNT(*) as count FROM radacct WHERE nasipaddress = %s AND acctstoptime IS NULL"
-    active_sessions = db_manager.execute_query(active_sessions_query, (nasname,))
+    active_sessions = await db_manager.execute_query(Q_NAS_ACTIVE_SESSION_COUNT, (nasname,), fetch_mode='scalar')
     
-    if active_sessions[0]['count'] > 0:
+    if active_sessions > 0:
         raise HTTPException(
             status_code=409,
-            detail=f"Cannot delete NAS. {active_sessions[0]['count']} active session(s) found"
+            detail=f"Cannot delete NAS. {active_sessions} active session(s) found"
         )
     
     # Delete NAS
-    delete_query = "DELETE FROM nas WHERE nasname = %s"
-    db_manager.execute_query(delete_query, (nasname,), fetch=False)
+    await db_manager.execute_query(Q_NAS_DELETE, (nasname,), fetch=False)
     
     return StatusResponse(message=f"NAS '{nasname}' deleted successfully")
 
 @app.put("/nas/{nasname}", response_model=StatusResponse)
 async def update_nas(
     nasname: str,
-    nas_update: NasUpdate,
-    token: str = Depends(verify_token)
+    nas_update: NasUpdate
 ):
     """Update NAS configuration."""
     
     # Check if NAS exists
-    check_query = "SELECT * FROM nas WHERE nasname = %s"
-    existing_nas = db_manager.execute_query(check_query, (nasname,))
+    existing_nas = await db_manager.execute_query(Q_NAS_EXISTS, (nasname,), fetch_mode='scalar')
     
     if not existing_nas:
         raise HTTPException(status_code=404, detail="NAS not found")
@@ -702,7 +1044,7 @@ async def update_nas(
     
     # Execute update
     update_query = f"UPDATE nas SET {', '.join(update_fields)} WHERE nasname = %s"
-    db_manager.execute_query(update_query, tuple(update_values), fetch=False)
+    await db_manager.execute_query(update_query, tuple(update_values), fetch=False)
     
     return StatusResponse(message=f"NAS '{nasname}' updated successfully")
 
@@ -710,40 +1052,40 @@ async def update_nas(
 @app.post("/session-dis", response_model=StatusResponse)
 async def disconnect_session(
     session: str = Query(...),
-    nas: str = Query(...),
-    token: str = Depends(verify_token)
+    nas: str = Query(...)
 ):
-    """Disconnect user session using radclient."""
+    """Disconnect user session with a RADIUS Disconnect-Request."""
     
     try:
-        cmd = f'echo Acct-Session-Id={session} | radclient -r 1 {nas}:3799 disconnect RGL@dmin321#'
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=30)
+        # Prefer the NAS secret from the nas table, falling back to RADIUS_COA_SECRET
+        nas_result = await db_manager.execute_query(Q_NAS_SECRET, (nas,))
+        secret = nas_result[0]['secret'] if nas_result else RADIUS_COA_SECRET
+        
+        if not secret:
+            raise HTTPException(status_code=404, detail="NAS secret not found")
         
-        if result.returncode == 0:
+        if await send_disconnect_request(nas, session, secret):
+            online_cache.clear()
             return StatusResponse(message="User session disconnected successfully")
         else:
             raise HTTPException(status_code=500, detail="Session disconnect failed")
     
-    except subprocess.TimeoutExpired:
+    except asyncio.TimeoutError:
         raise HTTPException(status_code=500, detail="Session disconnect timeout")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Session disconnect failed: {str(e)}")
 
 @app.post("/disconnect-user", response_model=StatusResponse)
 async def disconnect_user(
-    request: DisconnectUserRequest,
-    token: str = Depends(verify_token)
+    request: DisconnectUserRequest
 ):
     """Disconnect all active sessions for a user by username."""
     
     try:
         # Get all active sessions for the user
-        active_sessions_query = """
-            SELECT acctsessionid, nasipaddress 
-            FROM radacct 
-            WHERE username = %s AND acctstoptime IS NULL
-        """
-        sessions = db_manager.execute_query(active_sessions_query, (request.username,))
+        sessions = await db_manager.execute_query(Q_USER_ACTIVE_SESSIONS, (request.username,))
         
         if not sessions:
             raise HTTPException(status_code=404, detail="No active sessions found for user")
@@ -756,13 +1098,7 @@ async def disconnect_user(
             nas_ip = session['nasipaddress']
             
             # Get NAS secret from nas table
-            nas_secret_query = """
-                SELECT secret 
-                FROM nas 
-                WHERE nasname = %s
-                LIMIT 1
-            """
-            nas_result = db_manager.execute_query(nas_secret_query, (nas_ip,))
+            nas_result = await db_manager.execute_query(Q_NAS_SECRET, (nas_ip,))
             
             if not nas_result:
                 failed_sessions.append({
@@ -774,11 +1110,16 @@ async def disconnect_user(
             
             secret = nas_result[0]['secret']
             
-            # Execute radclient disconnect command
-            cmd = f'echo Acct-Session-Id={session_id} | radclient -r 1 {nas_ip}:3799 disconnect {secret}'
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=30)
+            # Send Disconnect-Request to the NAS
+            try:
+                acked = await send_disconnect_request(nas_ip, session_id, secret)
+                error = None if acked else "Disconnect request rejected by NAS"
+            except asyncio.TimeoutError:
+                error = "Disconnect request timed out"
+            except (OSError, ValueError) as e:
+                error = f"Disconnect request failed: {str(e)}"
             
-            if result.returncode == 0:
+            if error is None:
                 disconnected_sessions.append({
                     "session_id": session_id,
                     "nas_ip": nas_ip
@@ -787,9 +1128,12 @@ async def disconnect_user(
                 failed_sessions.append({
                     "session_id": session_id,
                     "nas_ip": nas_ip,
-                    "error": f"Disconnect command failed: {result.stderr}"
+                    "error": error
                 })
         
+        if disconnected_sessions:
+            online_cache.clear()
+        
         # Prepare response message
         if disconnected_sessions and not failed_sessions:
             message = f"Successfully disconnected {len(disconnected_sessions)} session(s) for user {request.username}"
@@ -803,8 +1147,6 @@ async def disconnect_user(
         
         return StatusResponse(message=message)
     
-    except subprocess.TimeoutExpired:
-        raise HTTPException(status_code=500, detail="Session disconnect timeout")
     except HTTPException:
         raise
     except Exception as e:
@@ -813,8 +1155,7 @@ async def disconnect_user(
 # Data Retention / Cleanup APIs
 @app.post("/cleanup/radacct", response_model=StatusResponse)
 async def cleanup_accounting_data(
-    request: DataCleanupRequest,
-    token: str = Depends(verify_token)
+    request: DataCleanupRequest
 ):
     """Delete accounting records older than specified days."""
     
@@ -824,13 +1165,7 @@ async def cleanup_accounting_data(
     
     # Preview mode if confirm=False
     if not request.confirm:
-        preview_query = """
-            SELECT COUNT(*) as records_to_delete,
-                   MIN(acctstarttime) as oldest_record
-            FROM radacct 
-            WHERE acctstarttime < DATE_SUB(NOW(), INTERVAL %s DAY)
-        """
-        result = db_manager.execute_query(preview_query, (request.retain_days,))
+        result = await db_manager.execute_query(Q_RADACCT_CLEANUP_PREVIEW, (request.retain_days,))
         oldest_date = str(result[0]['oldest_record']) if result[0]['oldest_record'] else "None"
         count = result[0]['records_to_delete']
         
@@ -839,11 +1174,7 @@ async def cleanup_accounting_data(
         )
     
     # Execute deletion
-    delete_query = """
-        DELETE FROM radacct 
-        WHERE acctstarttime < DATE_SUB(NOW(), INTERVAL %s DAY)
-    """
-    deleted_count = db_manager.execute_query(delete_query, (request.retain_days,), fetch=False)
+    deleted_count = await db_manager.execute_query(Q_RADACCT_CLEANUP, (request.retain_days,), fetch=False)
     
     return StatusResponse(
         message=f"Successfully deleted {deleted_count} accounting records older than {request.retain_days} days"
@@ -851,8 +1182,7 @@ async def cleanup_accounting_data(
 
 @app.post("/cleanup/radpostauth", response_model=StatusResponse)
 async def cleanup_auth_logs(
-    request: DataCleanupRequest,
-    token: str = Depends(verify_token)
+    request: DataCleanupRequest
 ):
     """Delete authentication logs older than specified days."""
     
@@ -862,13 +1192,7 @@ async def cleanup_auth_logs(
     
     # Preview mode if confirm=False
     if not request.confirm:
-        preview_query = """
-            SELECT COUNT(*) as records_to_delete,
-                   MIN(authdate) as oldest_record
-            FROM radpostauth 
-            WHERE authdate < DATE_SUB(NOW(), INTERVAL %s DAY)
-        """
-        result = db_manager.execute_query(preview_query, (request.retain_days,))
+        result = await db_manager.execute_query(Q_RADPOSTAUTH_CLEANUP_PREVIEW, (request.retain_days,))
         oldest_date = str(result[0]['oldest_record']) if result[0]['oldest_record'] else "None"
         count = result[0]['records_to_delete']
         
@@ -877,11 +1201,7 @@ async def cleanup_auth_logs(
         )
     
     # Execute deletion
-    delete_query = """
-        DELETE FROM radpostauth 
-        WHERE authdate < DATE_SUB(NOW(), INTERVAL %s DAY)
-    """
-    deleted_count = db_manager.execute_query(delete_query, (request.retain_days,), fetch=False)
+    deleted_count = await db_manager.execute_query(Q_RADPOSTAUTH_CLEANUP, (request.retain_days,), fetch=False)
     
     return StatusResponse(
         message=f"Successfully deleted {deleted_count} authentication log records older than {request.retain_days} days"
@@ -890,21 +1210,36 @@ async def cleanup_auth_logs(
 # Health Check
 @app.get("/health")
 async def health_check():
-    """Health check endpoint."""
-    try:
-        # Test database connection
-        test_query = "SELECT 1"
-        db_manager.execute_query(test_query)
-        db_status = "connected"
-    except Exception as e:
-        db_status = f"error: {str(e)}"
-    
-    return {
-        "status": "healthy" if db_status == "connected" else "unhealthy",
-        "database": db_status,
-        "timestamp": datetime.now().isoformat()
+    """Health check endpoint, served from the snapshot refreshed by refresh_health."""
+    age = time.monotonic() - app.state.health_checked_at
+    if age > HEALTH_STALE_INTERVALS * HEALTH_REFRESH_INTERVAL:
+        return {
+            **app.state.health,
+            "status": "unhealthy",
+            "database": f"error: health snapshot is {age:.0f}s old"
+        }
+    return app.state.health
+
+# OpenAPI: document the bearer scheme TokenMiddleware enforces
+def custom_openapi():
+    if app.openapi_schema:
+        return app.openapi_schema
+    
+    schema = get_openapi(title=app.title, version=app.version, description=app.description, routes=app.routes)
+    schema.setdefault("components", {})["securitySchemes"] = {
+        "HTTPBearer": {"type": "http", "scheme": "bearer"}
     }
+    for path, operations in schema["paths"].items():
+        if path not in PUBLIC_PATHS:
+            for operation in operations.values():
+                operation["security"] = [{"HTTPBearer": []}]
+    
+    app.openapi_schema = schema
+    return schema
+
+app.openapi = custom_openapi
 
+# Development server only; production runs gunicorn with gunicorn_conf.py
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("app:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
@@ -0,0 +1,28 @@
+"""
+Gunicorn settings for the production API container
+Runs app:app under uvicorn workers on uvloop + httptools
+"""
+
+import os
+
+from uvicorn.workers import UvicornWorker
+
+
+class RadiusUvicornWorker(UvicornWorker):
+    CONFIG_KWARGS = {"loop": "uvloop", "http": "httptools", "access_log": False}
+
+
+bind = f"0.0.0.0:{os.getenv('API_PORT', '8000')}"
+
+# Async workers: one per core, capped at 4 since os.cpu_count() reports the
+# host's cores inside a container. Each worker opens its own DB pool; app.py
+# splits the pool budget by WEB_CONCURRENCY, so export the final count to it.
+workers = int(os.getenv('WEB_CONCURRENCY', str(min(os.cpu_count() or 1, 4))))
+os.environ['WEB_CONCURRENCY'] = str(workers)
+worker_class = "gunicorn_conf.RadiusUvicornWorker"
+
+# Startup retries the DB pool for up to 60s while MySQL initializes; don't
+# let the arbiter kill workers that are still in lifespan startup
+timeout = 90
+keepalive = 5
+graceful_timeout = 30
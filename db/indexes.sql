@@ -0,0 +1,27 @@
+#
+#  indexes.sql -- extra radacct indexes for the API's hot queries.
+#
+#  Loaded automatically on a fresh database (03-indexes.sql in
+#  docker-compose). For an existing database, apply once with:
+#
+#      docker exec -i radius-db mysql -uroot -p radius < db/indexes.sql
+#
+#  MySQL has no partial indexes, so open sessions are found through the
+#  acctstoptime prefix (acctstoptime IS NULL is a ref lookup on it).
+#
+
+#
+#  Open sessions: /online, /onlinecount and the NAS in-use check.
+#  Covers every column /online returns (radacctid is the implicit PK suffix).
+#
+CREATE INDEX idx_radacct_open ON radacct (acctstoptime, username, nasipaddress, callingstationid, acctstarttime, framedipaddress);
+
+#
+#  Per-user open session lookups: /online/{username} and /disconnect-user.
+#
+CREATE INDEX idx_radacct_user_open ON radacct (username, acctstoptime);
+
+#
+#  /acct/{username}/... pages by (username, radacctid); the existing
+#  'username' key already provides this, as InnoDB appends the primary key.
+#